@@ -281,6 +281,69 @@ class Script(object):
 
         return ops
 
+    @classmethod
+    def find_asset_op(cls, script):
+        '''
+        Scans script once for its first OP_RVN_ASSET without building the
+        list get_ops returns.
+
+        Returns a tuple (script_end, asset_start, asset_end).  script_end is
+        the index of the OP_RVN_ASSET, or len(script) if there is none or it
+        is the first op.  If it is followed by a push, script[asset_start:asset_end]
+        is the pushed data (or the remaining script if the push fails to decode,
+        as with get_ops); otherwise both are None.
+        '''
+        op_asset = OpCodes.OP_RVN_ASSET.value
+        op_pushdata4 = OpCodes.OP_PUSHDATA4.value
+        script_len = len(script)
+
+        n = 0
+        while n < script_len:
+            op = script[n]
+            if op == op_asset:
+                if n == 0:
+                    break
+                push = n + 1
+                if push >= script_len or script[push] > op_pushdata4:
+                    return n, None, None
+                try:
+                    return (n, ) + cls._push_bounds(script, push)
+                except (IndexError, struct.error):
+                    return n, push, script_len
+            if op <= op_pushdata4:
+                try:
+                    n = cls._push_bounds(script, n)[1]
+                except (IndexError, struct.error):
+                    break
+            else:
+                n += 1
+
+        return script_len, None, None
+
+    @classmethod
+    def _push_bounds(cls, script, n):
+        '''
+        Returns the (start, end) indices of the data pushed by the op at script[n]
+
+        Raises IndexError or struct.error if the push runs past the end of the script
+        '''
+        op = script[n]
+        n += 1
+        if op < OpCodes.OP_PUSHDATA1:
+            dlen = op
+        elif op == OpCodes.OP_PUSHDATA1:
+            dlen = script[n]
+            n += 1
+        elif op == OpCodes.OP_PUSHDATA2:
+            dlen, = unpack_le_uint16_from(script[n: n + 2])
+            n += 2
+        else:
+            dlen, = unpack_le_uint32_from(script[n: n + 4])
+            n += 4
+        if n + dlen > len(script):
+            raise IndexError
+        return n, n + dlen
+
     @classmethod
     def push_data(cls, data):
         '''Returns the opcodes to push the data on the stack.'''
@@ -54,34 +54,48 @@ class OPPushDataGeneric:
                or (isinstance(item, type) and issubclass(item, cls))
 
 
-SCRIPTPUBKEY_TEMPLATE_P2PK = [OPPushDataGeneric(lambda x: x in (33, 65)), OpCodes.OP_CHECKSIG]
+def compile_template(template):
+    """Precompute a script template for match_script_against_template.
+
+    Each item becomes the frozenset of op values it accepts, so matching
+    needs no per-item type dispatch.  Op values from Script.get_ops are 0-255,
+    or -1 where a script failed to decode."""
+    compiled = []
+    for item in template:
+        if OPPushDataGeneric.is_instance(item):
+            compiled.append(frozenset(op for op in range(-1, 256) if item.check_data_len(op)))
+        else:
+            compiled.append(frozenset((int(item), )))
+    return tuple(compiled)
+
+
+SCRIPTPUBKEY_TEMPLATE_P2PK = compile_template([OPPushDataGeneric(lambda x: x in (33, 65)),
+                                               OpCodes.OP_CHECKSIG])
 
 # Marks an address as valid for restricted assets via qualifier or restricted itself.
-ASSET_NULL_TEMPLATE = [OpCodes.OP_RVN_ASSET, OPPushDataGeneric(lambda x: x == 20), OPPushDataGeneric()]
+ASSET_NULL_TEMPLATE = compile_template([OpCodes.OP_RVN_ASSET, OPPushDataGeneric(lambda x: x == 20),
+                                        OPPushDataGeneric()])
 # Used with creating restricted assets. Dictates the qualifier assets associated.
-ASSET_NULL_VERIFIER_TEMPLATE = [OpCodes.OP_RVN_ASSET, OpCodes.OP_RESERVED, OPPushDataGeneric()]
+ASSET_NULL_VERIFIER_TEMPLATE = compile_template([OpCodes.OP_RVN_ASSET, OpCodes.OP_RESERVED,
+                                                 OPPushDataGeneric()])
 # Stop all movements of a restricted asset.
-ASSET_GLOBAL_RESTRICTION_TEMPLATE = [OpCodes.OP_RVN_ASSET, OpCodes.OP_RESERVED, OpCodes.OP_RESERVED,
-                                     OPPushDataGeneric()]
+ASSET_GLOBAL_RESTRICTION_TEMPLATE = compile_template([OpCodes.OP_RVN_ASSET, OpCodes.OP_RESERVED,
+                                                      OpCodes.OP_RESERVED, OPPushDataGeneric()])
 
 
 # -1 if doesn't match, positive if does. Indicates index in script
 def match_script_against_template(script, template) -> int:
-    """Returns whether 'script' matches 'template'."""
+    """Returns whether 'script' matches 'template'.
+
+    'template' must have been built by compile_template."""
     if script is None:
         return -1
     if len(script) < len(template):
         return -1
-    ctr = 0
-    for i in range(len(template)):
-        ctr += 1
-        template_item = template[i]
-        script_item = script[i]
-        if OPPushDataGeneric.is_instance(template_item) and template_item.check_data_len(script_item[0]):
-            continue
-        if template_item != script_item[0]:
+    for allowed_ops, script_item in zip(template, script):
+        if script_item[0] not in allowed_ops:
             return -1
-    return ctr
+    return len(template)
 
 logger = class_logger(__name__, 'BlockProcessor')
 
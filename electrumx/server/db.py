@@ -1007,7 +1007,7 @@ class DB:
             return [lookup_utxo(*hashX_pair) for hashX_pair in hashX_pairs]
 
         hashX_pairs = await run_in_thread(lookup_hashXs)
-        return [i for i in await run_in_thread(lookup_utxos, hashX_pairs) if i]
+        return await run_in_thread(lookup_utxos, hashX_pairs)
 
     # For external use
     
@@ -1204,7 +1204,7 @@ class DB:
 
     async def lookup_assets(self, prevouts):
         '''For each prevout, lookup it up in the DB and return a (hashX,
-        value) pair or None if not found.
+        value, name) tuple or None if not found.
 
         Used by the mempool code.
         '''
@@ -1252,4 +1252,4 @@ class DB:
             return [lookup_asset(*hashX_pair) for hashX_pair in hashX_pairs]
 
         hashX_pairs = await run_in_thread(lookup_hashXs)
-        return [i for i in await run_in_thread(lookup_assets, hashX_pairs) if i]
\ No newline at end of file
+        return await run_in_thread(lookup_assets, hashX_pairs)
\ No newline at end of file
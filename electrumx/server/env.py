@@ -8,6 +8,7 @@
 '''Class for handling environment configuration and defaults.'''
 
 
+import os
 import re
 from ipaddress import IPv4Address, IPv6Address
 
@@ -72,6 +73,7 @@ class Env(EnvBase):
         self.drop_client = self.custom("DROP_CLIENT", None, re.compile)
         self.cache_MB = self.integer('CACHE_MB', 1200)
         self.reorg_limit = self.integer('REORG_LIMIT', self.coin.REORG_LIMIT)
+        self.mempool_parse_workers = self.sane_mempool_parse_workers()
 
         # Server limits to help prevent DoS
 
@@ -117,6 +119,19 @@ class Env(EnvBase):
             value = 512  # that is what returned by stdio's _getmaxstdio()
         return value
 
+    def sane_mempool_parse_workers(self):
+        '''Return the number of processes to parse mempool transactions in.
+        Normally this is MEMPOOL_PARSE_WORKERS.  The default is one per CPU
+        this process may run on, up to 4, or none with a single CPU, as
+        the workers would then only compete with the server for it.'''
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            # Not available on macOS or Windows
+            cpus = os.cpu_count() or 1
+        default = min(cpus, 4) if cpus > 1 else 0
+        return max(0, self.integer('MEMPOOL_PARSE_WORKERS', default))
+
     def _parse_services(self, services_str, default_func):
         result = []
         for service_str in services_str.split(','):
@@ -6,80 +6,56 @@
 # and warranty status of this software.
 
 '''Mempool handling.'''
-import itertools
-import math
+import asyncio
+import multiprocessing
 import time
 from abc import ABC, abstractmethod
-from collections import defaultdict
-from typing import Callable, Dict, Sequence, Tuple, Set
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Sequence, Tuple, Set, Union
 
-import attr
 from aiorpcx import TaskGroup, run_in_thread, sleep
-from asyncio import Lock
 
 from electrumx.lib.addresses import public_key_to_address
-from electrumx.lib.hash import hash_to_hex_str, hex_str_to_hash
-from electrumx.lib.script import OpCodes, ScriptError, Script
+from electrumx.lib.script import ScriptError, Script
 from electrumx.lib.tx import read_tx
 from electrumx.lib.util import DataParser, class_logger, chunks, base_encode
 from electrumx.server.db import UTXO, ASSET
 
 
-class OPPushDataGeneric:
-    def __init__(self, pushlen: Callable = None):
-        if pushlen is not None:
-            self.check_data_len = pushlen
+class MemPoolTx(object):
+    __slots__ = ('prevouts', 'in_pairs', 'out_pairs', 'size', 'fee', 'fee_bucket',
+                 'has_unconfirmed_inputs')
 
-    @classmethod
-    def check_data_len(cls, datalen: int) -> bool:
-        # Opcodes below OP_PUSHDATA4 all just push data onto stack, and are
-        return OpCodes.OP_PUSHDATA4 >= datalen >= 0
+    def __init__(self, prevouts, out_pairs, size):
+        self.prevouts = prevouts
+        # (hashX, value, is_asset, asset_name) tuples
+        self.in_pairs = None
+        self.out_pairs = out_pairs
+        self.size = size
+        # The remainder are set when the tx is accepted
+        self.fee = 0
+        # fee / size in units of 0.1 sat/byte, rounded down
+        self.fee_bucket = 0
+        # True if any input spends another mempool tx
+        self.has_unconfirmed_inputs = False
 
-    @classmethod
-    def is_instance(cls, item):
-        # accept objects that are instances of this class
-        # or other classes that are subclasses
-        return isinstance(item, cls) \
-               or (isinstance(item, type) and issubclass(item, cls))
-
-
-SCRIPTPUBKEY_TEMPLATE_P2PK = [OPPushDataGeneric(lambda x: x in (33, 65)), OpCodes.OP_CHECKSIG]
-
-
-# -1 if doesn't match, positive if does. Indicates index in script
-def match_script_against_template(script, template) -> int:
-    """Returns whether 'script' matches 'template'."""
-    if script is None:
-        return -1
-    if len(script) < len(template):
-        return -1
-    ctr = 0
-    for i in range(len(template)):
-        ctr += 1
-        template_item = template[i]
-        script_item = script[i]
-        if OPPushDataGeneric.is_instance(template_item) and template_item.check_data_len(script_item[0]):
-            continue
-        if template_item != script_item[0]:
-            return -1
-    return ctr
 
+def _intern_pair(pair, intern):
+    '''Return pair with its hashX replaced by the interned one.'''
+    hashX = pair[0]
+    shared = intern(hashX, hashX)
+    return pair if shared is hashX else (shared, ) + pair[1:]
 
-@attr.s(slots=True)
-class MemPoolTx(object):
-    prevouts = attr.ib()
-    # (hashX, value, is_asset, asset_name) tuple
-    in_pairs = attr.ib()
-    out_pairs = attr.ib()
-    fee = attr.ib()
-    size = attr.ib()
+
+def _spenders(prevout_spenders, prev_hash):
+    '''Return the hashes of the txs spending outputs of prev_hash.'''
+    spenders = prevout_spenders.get(prev_hash, ())
+    return (spenders, ) if type(spenders) is bytes else spenders
 
 
-@attr.s(slots=True)
-class MemPoolTxSummary(object):
-    hash = attr.ib()
-    fee = attr.ib()
-    has_unconfirmed_inputs = attr.ib()
+MemPoolTxSummary = namedtuple("MemPoolTxSummary", "hash fee has_unconfirmed_inputs")
 
 
 class DBSyncError(Exception):
@@ -126,7 +102,11 @@ class MemPoolAPI(ABC):
 
     @abstractmethod
     async def lookup_assets(self, prevouts):
-        pass
+        '''Return a list of (hashX, value, asset name) tuples for each
+        prevout if it is an unspent asset, otherwise return None.
+
+        prevouts - an iterable of (hash, index) pairs
+        '''
 
     @abstractmethod
     async def on_mempool(self, touched, height, assets):
@@ -135,6 +115,131 @@ class MemPoolAPI(ABC):
         daemon's height at the time the mempool was obtained.'''
 
 
+def _parse_tx_chunk(coin, hashes, hex_hashes, raw_txs):
+    '''Deserialize raw mempool transactions.  Return a (tx_map, asset
+    creates, asset reissues) tuple; the asset maps are keyed by asset
+    name with (tx_hash, stats) values.
+
+    This function is pure and module-level so it can be run in a
+    process pool.
+    '''
+    to_hashX = coin.hashX_from_script
+    read_tx_and_size = read_tx
+
+    asset_meta_creates = {}
+    asset_meta_reissues = {}
+    txs = {}
+    for tx_hash, hex_hash, raw_tx in zip(hashes, hex_hashes, raw_txs):
+        # The daemon may have evicted the tx from its
+        # mempool or it may have gotten in a block
+        if not raw_tx:
+            continue
+        # Parse a view so scripts and hashes are not copied out of raw_tx;
+        # anything kept in the MemPoolTx must be converted to bytes
+        tx, tx_size, wit_hash = read_tx_and_size(memoryview(raw_tx), 0)
+        # Convert the inputs and outputs into (hashX, value) pairs
+        # Drop generation-like inputs from MemPoolTx.prevouts
+        txin_pairs = tuple((bytes(txin.prev_hash), txin.prev_idx)
+                           for txin in tx.inputs
+                           if not txin.is_generation())
+        txout_tuple_list = []
+        for vout_n, txout in enumerate(tx.outputs):
+            value = txout.value
+
+            # Every vout needs to be added for other methods to work properly
+
+            # Best effort for standard scripts
+            pk_script = txout.pk_script
+            script_hash_end, asset_start, asset_end = Script.find_asset_op(pk_script)
+
+            if script_hash_end < len(pk_script):
+                # This script has OP_RVN_ASSET. Use everything before this for the script hash.
+                hashX = to_hashX(pk_script[:script_hash_end])
+            else:
+                # There is no OP_RVN_ASSET. Hash as-is.
+                hashX = to_hashX(pk_script)
+
+            # Best effort for standard asset portions
+            if asset_start is not None:
+                try:
+                    asset_script = pk_script[asset_start:asset_end]
+                    asset_deserializer = DataParser(asset_script)
+                    asset_deserializer.read_bytes(3)
+                    asset_type = asset_deserializer.read_int()
+                    asset_name = asset_deserializer.read_var_bytes().decode('ascii')
+                    if asset_type == b'o'[0]:
+                        txout_tuple_list.append((hashX, 100_000_000, True, asset_name))
+                        asset_meta_creates[asset_name] = tx_hash, {
+                            'sats_in_circulation': 100_000_000,
+                            'divisions': 0,
+                            'reissuable': False,
+                            'has_ipfs': False,
+                            'source': {
+                                'tx_hash': hex_hash,
+                                'tx_pos': vout_n,
+                                'height': -1
+                            }
+                        }
+                    else:
+                        value = int.from_bytes(asset_deserializer.read_bytes(8), 'little', signed=False)
+                        txout_tuple_list.append((hashX, value, True, asset_name))
+                        # Asset reissue chaining is not allowed. There may only be
+                        # one reissue in the mempool per asset name
+                        if asset_type == b'r'[0]:
+                            divisions = asset_deserializer.read_int()
+                            reissuable = asset_deserializer.read_int()
+                            if asset_deserializer.cursor + 34 <= asset_deserializer.length:
+                                asset_data = asset_deserializer.read_bytes(34)
+                            else:
+                                asset_data = None
+                            d = {
+                                'sats_in_circulation': value,
+                                'divisions': divisions,
+                                'reissuable': True if reissuable != 0 else False,
+                                'has_ipfs': True if asset_data else False,
+                            }
+                            if asset_data:
+                              d['ipfs'] = base_encode(asset_data, 58) if asset_data else None
+
+                            d['source'] = {
+                                    'tx_hash': hex_hash,
+                                    'tx_pos': vout_n,
+                                    'height': -1
+                                }
+                            asset_meta_reissues[asset_name] = tx_hash, d
+                        elif asset_type == b'q'[0]:
+                            divisions = asset_deserializer.read_int()
+                            reissuable = asset_deserializer.read_int()
+                            has_meta = asset_deserializer.read_byte()
+                            if has_meta != b'\0':
+                                asset_data = asset_deserializer.read_bytes(34)
+                            else:
+                                asset_data = None
+
+                            d = {
+                                'sats_in_circulation': value,
+                                'divisions': divisions,
+                                'has_ipfs': True if asset_data else False,
+                                'reissuable': True if reissuable != 0 else False,
+                            }
+                            if asset_data:
+                                d['ipfs'] = base_encode(asset_data, 58) if asset_data else None
+                            d['source'] = {
+                                    'tx_hash': hex_hash,
+                                    'tx_pos': vout_n,
+                                    'height': -1
+                                }
+
+                            asset_meta_creates[asset_name] = tx_hash, d
+                except Exception:
+                    txout_tuple_list.append((hashX, value, False, None))
+            else:
+                txout_tuple_list.append((hashX, value, False, None))
+
+        txs[tx_hash] = MemPoolTx(txin_pairs, tuple(txout_tuple_list), tx_size)
+    return txs, asset_meta_creates, asset_meta_reissues
+
+
 class MemPool(object):
     '''Representation of the daemon's mempool.
 
@@ -146,16 +251,48 @@ class MemPool(object):
     maintain the following maps:
 
        tx:     tx_hash -> MemPoolTx
-       hashXs: hashX   -> set of all hashes of txs touching the hashX
+       hashXs: hashX   -> all hashes of txs touching the hashX; a tuple
+                          if there are few of them, otherwise a set
+       hashX_deltas: hashX -> tx_hash -> what that tx does to the hashX, as
+                     a (sat delta, utxos, assets) tuple.  utxos is a tuple
+                     of (pos, value) pairs; assets is None if no asset
+                     touches the hashX, otherwise a (name -> asset delta,
+                     tuple of (pos, name, value) outputs) pair
+       prevout_spenders: prev_hash -> hash of the mempool tx spending its
+                         outputs, or a set of hashes if there are several
+
+    The first three are updated in private copies while refreshing,
+    then published as txs, hashXs and hashX_deltas once the refresh
+    completes.  Published maps are never mutated, and a MemPoolTx is only
+    changed after it is published when the next refresh is published, so
+    readers (including the histogram thread) need no lock and always see
+    a whole refresh.
     '''
 
+    # Most hashXs are touched by one or two txs; a tuple is much smaller
+    # than a set until it holds more than this many
+    HASHX_TUPLE_MAX = 4
+
     def __init__(self, env, api, refresh_secs=5.0, log_status_secs=60.0):
         assert isinstance(api, MemPoolAPI)
         self.coin = env.coin
         self.api = api
         self.logger = class_logger(__name__, self.__class__.__name__)
+        self._txs = {}
+        # Sum of the sizes of txs, maintained as they come and go
+        self._total_size = 0
+        self._hashXs = {}  # None can be a key
+        # One shared bytes object per hashX in the mempool
+        self._hashX_pool: Dict[bytes, bytes] = {}
+        # Per-(hashX, tx_hash) aggregates so queries needn't rescan pairs
+        self._hashX_deltas: Dict[bytes, Dict[bytes, tuple]] = {}
+        # Published snapshots of the above for the external interface
         self.txs = {}
-        self.hashXs = defaultdict(set)  # None can be a key
+        self.hashXs = {}
+        self.hashX_deltas: Dict[bytes, Dict[bytes, tuple]] = {}
+        # Keyed by the prev_hash of every mempool tx input, confirmed or not,
+        # so has_unconfirmed_inputs can be kept current as txs come and go
+        self.prevout_spenders: Dict[bytes, Union[bytes, Set[bytes]]] = {}
         self.asset_creates = {}
         self.tx_to_asset_create: Dict[bytes, Set[str]] = {}
         self.asset_reissues = {}
@@ -163,8 +300,16 @@ class MemPool(object):
         self.cached_compact_histogram = []
         self.refresh_secs = refresh_secs
         self.log_status_secs = log_status_secs
-        # Prevents mempool refreshes during fee histogram calculation
-        self.lock = Lock()
+        # Raw tx parsing is CPU bound; spread chunks across processes
+        # unless there are no workers, when it is done in a thread
+        self.parse_workers = env.mempool_parse_workers
+        self._parse_pool = self._new_parse_pool() if self.parse_workers else None
+
+    def _new_parse_pool(self):
+        # Don't fork the server process: it has threads running that
+        # could hold locks the children would inherit
+        return ProcessPoolExecutor(max_workers=self.parse_workers,
+                                   mp_context=multiprocessing.get_context('forkserver'))
 
     async def _logging(self, synchronized_event):
         '''Print regular logs of mempool stats.'''
@@ -175,7 +320,7 @@ class MemPool(object):
         elapsed = time.monotonic() - start
         self.logger.info(f'synced in {elapsed:.2f}s')
         while True:
-            mempool_size = sum(tx.size for tx in self.txs.values()) / 1_000_000
+            mempool_size = self._total_size / 1_000_000
             self.logger.info(f'{len(self.txs):,d} txs {mempool_size:.2f} MB '
                              f'touching {len(self.hashXs):,d} addresses')
             await sleep(self.log_status_secs)
@@ -184,22 +329,20 @@ class MemPool(object):
     async def _refresh_histogram(self, synchronized_event):
         while True:
             await synchronized_event.wait()
-            async with self.lock:
-                # Threaded as can be expensive
-                await run_in_thread(self._update_histogram, 100_000)
+            # Threaded as can be expensive
+            await run_in_thread(self._update_histogram, 100_000)
             await sleep(self.coin.MEMPOOL_HISTOGRAM_REFRESH_SECS)
 
     def _update_histogram(self, bin_size):
         # Build a histogram by fee rate
+        # A published snapshot, so safe to read from this thread
         histogram = defaultdict(int)
         for tx in self.txs.values():
-            fee_rate = tx.fee / tx.size
-            # use 0.1 sat/byte resolution
-            # note: rounding *down* is intentional. This ensures txs
-            #       with a given fee rate will end up counted in the expected
-            #       bucket/interval of the compact histogram.
-            fee_rate = math.floor(10 * fee_rate) / 10
-            histogram[fee_rate] += tx.size
+            histogram[tx.fee_bucket] += tx.size
+
+        # _compress_histogram wants the highest fee rate first
+        histogram = {bucket / 10: size
+                     for bucket, size in sorted(histogram.items(), reverse=True)}
 
         compact = self._compress_histogram(histogram, bin_size=bin_size)
         self.logger.info(f'compact fee histogram: {compact}')
@@ -212,7 +355,8 @@ class MemPool(object):
     ) -> Sequence[Tuple[float, int]]:
         '''Calculate and return a compact fee histogram as needed for
         "mempool.get_fee_histogram" protocol request.
-        histogram: feerate (sat/byte) -> total size in bytes of txs that pay approx feerate
+        histogram: feerate (sat/byte) -> total size in bytes of txs that pay approx feerate,
+                   ordered by descending feerate
         '''
         # Now compact it.  For efficiency, get_fees returns a
         # compact histogram with variable bin size.  The compact
@@ -226,7 +370,7 @@ class MemPool(object):
         compact = []
         cum_size = 0
         prev_fee_rate = None
-        for fee_rate, size in sorted(histogram.items(), reverse=True):
+        for fee_rate, size in histogram.items():
             # if there is a big lump of txns at this specific size,
             # consider adding the previous item now (if not added already)
             if size > 2 * bin_size and prev_fee_rate is not None and cum_size > 0:
@@ -242,22 +386,33 @@ class MemPool(object):
             prev_fee_rate = fee_rate
         return compact
 
-    def _accept_transactions(self, tx_map, utxo_map, touched, assets_touched: Set[str]):
+    def _accept_transactions(self, tx_map, utxo_map, touched, assets_touched: Set[str],
+                             rechecks: Set[bytes]):
         '''Accept transactions in tx_map to the mempool if all their inputs
         can be found in the existing mempool or a utxo_map from the
-        DB.
+        DB.  A tx spending another tx in tx_map is retried as soon as
+        that tx is accepted.  Hashes of txs already in the mempool whose
+        has_unconfirmed_inputs may have changed are added to rechecks.
 
-        Returns an (unprocessed tx_map, unspent utxo_map) pair.
+        Returns the map of unprocessed txs.
         '''
-        hashXs = self.hashXs
-        txs = self.txs
+        hashXs = self._hashXs
+        hashX_deltas = self._hashX_deltas
+        intern = self._hashX_pool.setdefault
+        tuple_max = self.HASHX_TUPLE_MAX
+        prevout_spenders = self.prevout_spenders
+        txs = self._txs
         tx_to_create = self.tx_to_asset_create
         tx_to_reissue = self.tx_to_asset_reissue
 
         deferred = {}
-        unspent = set(utxo_map)
+        # prev_hash -> hashes of deferred txs waiting for it
+        waiters = defaultdict(list)
+        pending = deque(tx_map)
         # Try to find all prevouts so we can accept the TX
-        for tx_hash, tx in tx_map.items():
+        while pending:
+            tx_hash = pending.popleft()
+            tx = tx_map[tx_hash]
             in_pairs = []
             try:
                 for prevout in tx.prevouts:
@@ -269,29 +424,89 @@ class MemPool(object):
                     in_pairs.append(utxo)
             except KeyError:
                 deferred[tx_hash] = tx
+                waiters[prev_hash].append(tx_hash)
                 continue
 
-            # Spend the prevouts
-            unspent.difference_update(tx.prevouts)
+            deferred.pop(tx_hash, None)
 
             # Save the in_pairs, compute the fee and accept the TX
-            tx.in_pairs = tuple(in_pairs)
+            # Share one bytes object per hashX across all txs touching it
+            tx.in_pairs = tuple(_intern_pair(pair, intern) for pair in in_pairs)
+            tx.out_pairs = tuple(_intern_pair(pair, intern) for pair in tx.out_pairs)
             # Avoid negative fees if dealing with generation-like transactions
             # because some in_parts would be missing
-            tx.fee = max(0, (sum((v if not is_asset else 0) for _, v, is_asset, _ in tx.in_pairs) -
-                             sum((v if not is_asset else 0) for _, v, is_asset, _ in tx.out_pairs)))
+            tx.fee = max(0, (sum(v for _, v, is_asset, _ in tx.in_pairs if not is_asset) -
+                             sum(v for _, v, is_asset, _ in tx.out_pairs if not is_asset)))
+            # use 0.1 sat/byte resolution
+            # note: rounding *down* is intentional. This ensures txs
+            #       with a given fee rate will end up counted in the expected
+            #       bucket/interval of the compact histogram.
+            tx.fee_bucket = 10 * tx.fee // tx.size
+            for prev_hash, _prev_index in tx.prevouts:
+                if prev_hash in txs:
+                    tx.has_unconfirmed_inputs = True
+                spenders = prevout_spenders.get(prev_hash)
+                if spenders is None:
+                    prevout_spenders[prev_hash] = tx_hash
+                elif type(spenders) is not bytes:
+                    spenders.add(tx_hash)
+                elif spenders != tx_hash:
+                    prevout_spenders[prev_hash] = {spenders, tx_hash}
+            # Txs spending this one were accepted while it was confirmed,
+            # e.g. before a reorg
+            rechecks.update(_spenders(prevout_spenders, tx_hash))
             txs[tx_hash] = tx
-
-            for hashX, _value, _, _ in itertools.chain(tx.in_pairs, tx.out_pairs):
+            self._total_size += tx.size
+
+            # Sum what the tx does to each hashX it touches
+            sat_deltas = {}
+            tx_utxos = {}
+            asset_deltas = {}
+            asset_outs = {}
+            for hashX, value, is_asset, name in tx.in_pairs:
+                if is_asset:
+                    deltas = asset_deltas.setdefault(hashX, {})
+                    deltas[name] = deltas.get(name, 0) - value
+                    sat_deltas.setdefault(hashX, 0)
+                else:
+                    sat_deltas[hashX] = sat_deltas.get(hashX, 0) - value
+
+            for pos, (hashX, value, is_asset, name) in enumerate(tx.out_pairs):
+                if is_asset:
+                    deltas = asset_deltas.setdefault(hashX, {})
+                    deltas[name] = deltas.get(name, 0) + value
+                    asset_outs.setdefault(hashX, []).append((pos, name, value))
+                    sat_deltas.setdefault(hashX, 0)
+                else:
+                    sat_deltas[hashX] = sat_deltas.get(hashX, 0) + value
+                    tx_utxos.setdefault(hashX, []).append((pos, value))
+
+            for hashX, sat_delta in sat_deltas.items():
                 touched.add(hashX)
-                hashXs[hashX].add(tx_hash)
-            
+                tx_hashes = hashXs.get(hashX, ())
+                if type(tx_hashes) is not tuple:
+                    tx_hashes.add(tx_hash)
+                elif len(tx_hashes) < tuple_max:
+                    hashXs[hashX] = tx_hashes + (tx_hash, )
+                else:
+                    hashXs[hashX] = set(tx_hashes)
+                    hashXs[hashX].add(tx_hash)
+                # Most hashXs see no assets; keep None rather than empty maps
+                assets = None
+                if hashX in asset_deltas:
+                    assets = (asset_deltas[hashX], tuple(asset_outs.get(hashX, ())))
+                hashX_deltas.setdefault(hashX, {})[tx_hash] = (
+                    sat_delta, tuple(tx_utxos.get(hashX, ())), assets)
+
             if tx_hash in tx_to_create:
                 assets_touched.update(tx_to_create[tx_hash])
             if tx_hash in tx_to_reissue:
                 assets_touched.update(tx_to_reissue[tx_hash])
 
-        return deferred, {prevout: utxo_map[prevout] for prevout in unspent}
+            # Retry txs that were waiting on this one
+            pending.extend(waiters.pop(tx_hash, ()))
+
+        return deferred
 
     async def _refresh_hashes(self, synchronized_event):
         '''Refresh our view of the daemon's mempool.'''
@@ -304,10 +519,9 @@ class MemPool(object):
             hex_hashes = await self.api.mempool_hashes()
             if height != await self.api.height():
                 continue
-            hashes = set(hex_str_to_hash(hh) for hh in hex_hashes)
+            hashes = {bytes.fromhex(hh)[::-1] for hh in hex_hashes}
             try:
-                async with self.lock:
-                    await self._process_mempool(hashes, touched, assets_touched, height)
+                await self._process_mempool(hashes, touched, assets_touched, height)
             except DBSyncError:
                 # The UTXO DB is not at the same height as the
                 # mempool; wait and try again
@@ -322,8 +536,13 @@ class MemPool(object):
 
     async def _process_mempool(self, all_hashes, touched, assets_touched, mempool_height):
         # Re-sync with the new set of hashes
-        txs = self.txs
-        hashXs = self.hashXs
+        txs = self._txs
+        hashXs = self._hashXs
+        hashX_deltas = self._hashX_deltas
+        hashX_pool = self._hashX_pool
+        prevout_spenders = self.prevout_spenders
+        # Txs whose has_unconfirmed_inputs may need updating
+        rechecks = set()
 
         tx_to_create = self.tx_to_asset_create
         tx_to_reissue = self.tx_to_asset_reissue
@@ -334,8 +553,11 @@ class MemPool(object):
             raise DBSyncError
 
         # First handle txs that have disappeared
-        for tx_hash in set(txs).difference(all_hashes):
+        # (a list as txs is mutated in the loop)
+        removed_hashes = [tx_hash for tx_hash in txs if tx_hash not in all_hashes]
+        for tx_hash in removed_hashes:
             tx = txs.pop(tx_hash)
+            self._total_size -= tx.size
 
             reissued_assets = tx_to_reissue.pop(tx_hash, set())
             for reissued_asset in reissued_assets:
@@ -345,213 +567,163 @@ class MemPool(object):
             for created_asset in created_assets:
                 creates.pop(created_asset, None)
 
-            tx_hashXs = set(hashX for hashX, value, _, _ in tx.in_pairs)
-            tx_hashXs.update(hashX for hashX, value, _, _ in tx.out_pairs)
+            for prev_hash, _prev_index in tx.prevouts:
+                spenders = prevout_spenders.get(prev_hash)
+                if type(spenders) is bytes:
+                    # None if several inputs spent outputs of prev_hash
+                    if spenders == tx_hash:
+                        del prevout_spenders[prev_hash]
+                elif spenders is not None:
+                    spenders.discard(tx_hash)
+                    if len(spenders) == 1:
+                        prevout_spenders[prev_hash], = spenders
+            # Txs spending this one may now have only confirmed inputs.
+            # Keep their entry in case this tx returns to the mempool
+            rechecks.update(_spenders(prevout_spenders, tx_hash))
+
+            tx_hashXs = set(hashX for hashX, _, _, _ in tx.in_pairs)
+            tx_hashXs.update(hashX for hashX, _, _, _ in tx.out_pairs)
             for hashX in tx_hashXs:
-                hashXs[hashX].remove(tx_hash)
-                if not hashXs[hashX]:
+                tx_hashes = hashXs[hashX]
+                if len(tx_hashes) == 1:
                     del hashXs[hashX]
+                    del hashX_pool[hashX]
+                elif type(tx_hashes) is tuple:
+                    hashXs[hashX] = tuple(h for h in tx_hashes if h != tx_hash)
+                else:
+                    tx_hashes.remove(tx_hash)
+                deltas = hashX_deltas[hashX]
+                del deltas[tx_hash]
+                if not deltas:
+                    del hashX_deltas[hashX]
             touched.update(tx_hashXs)
 
         # Process new transactions
-        new_hashes = list(all_hashes.difference(txs))
+        new_hashes = [tx_hash for tx_hash in all_hashes if tx_hash not in txs]
         if new_hashes:
             group = TaskGroup()
             for hashes in chunks(new_hashes, 200):
-                coro = self._fetch_and_accept(hashes, all_hashes, touched, assets_touched)
+                coro = self._fetch_and_parse(hashes)
                 await group.spawn(coro)
 
             tx_map = {}
-            utxo_map = {}
             async for task in group:
-                deferred, unspent = task.result()                
-
-                tx_map.update(deferred)
-                utxo_map.update(unspent)
+                tx_map.update(task.result())
 
-            prior_count = 0
-            # FIXME: this is not particularly efficient
-            while tx_map and len(tx_map) != prior_count:
-                prior_count = len(tx_map)
-                tx_map, utxo_map = self._accept_transactions(tx_map, utxo_map,
-                                                             touched, assets_touched)
+            tx_map = await self._resolve_and_accept(tx_map, all_hashes, touched,
+                                                    assets_touched, rechecks)
             if tx_map:
                 self.logger.error(f'{len(tx_map)} txs dropped')
 
+        if removed_hashes or new_hashes:
+            self._publish(touched, rechecks)
+
         return touched
 
-    async def _fetch_and_accept(self, hashes, all_hashes, touched, assets_touched):
-        '''Fetch a list of mempool transactions.'''
-        hex_hashes_iter = (hash_to_hex_str(hash) for hash in hashes)
-        raw_txs = await self.api.raw_transactions(hex_hashes_iter)
+    def _publish(self, touched, rechecks):
+        '''Replace the maps read by the external interface with copies of
+        the current ones.  Entries of hashXs not in touched are unchanged,
+        so they are shared with the previous copies.
+
+        MemPoolTx objects are shared with the previous copies too, so
+        has_unconfirmed_inputs of the txs in rechecks is updated here.'''
+        txs = self._txs
+        for tx_hash in rechecks:
+            tx = txs.get(tx_hash)
+            if tx:
+                tx.has_unconfirmed_inputs = any(prev_hash in txs
+                                                for prev_hash, _prev_index in tx.prevouts)
+        hashXs = dict(self.hashXs)
+        hashX_deltas = dict(self.hashX_deltas)
+        for hashX in touched:
+            tx_hashes = self._hashXs.get(hashX)
+            if tx_hashes is None:
+                hashXs.pop(hashX, None)
+                hashX_deltas.pop(hashX, None)
+            else:
+                if type(tx_hashes) is not tuple:
+                    tx_hashes = frozenset(tx_hashes)
+                hashXs[hashX] = tx_hashes
+                hashX_deltas[hashX] = dict(self._hashX_deltas[hashX])
+        self.txs, self.hashXs, self.hashX_deltas = dict(txs), hashXs, hashX_deltas
+
+    async def _fetch_and_parse(self, hashes):
+        '''Fetch and deserialize a list of mempool transactions.
+
+        Returns a tx_hash -> MemPoolTx map.'''
+        hex_hashes = [hash[::-1].hex() for hash in hashes]
+        raw_txs = await self.api.raw_transactions(hex_hashes)
 
         creates = self.asset_creates
         reissues = self.asset_reissues
         tx_to_create = self.tx_to_asset_create
         tx_to_reissue = self.tx_to_asset_reissue
 
-        def deserialize_txs():    # This function is pure
-            to_hashX = self.coin.hashX_from_script
-            read_tx_and_size = read_tx
-
-            asset_meta_creates = {}
-            asset_meta_reissues = {}
-            txs = {}
-            for tx_hash, raw_tx in zip(hashes, raw_txs):
-                # The daemon may have evicted the tx from its
-                # mempool or it may have gotten in a block
-                if not raw_tx:
-                    continue
-                tx, tx_size, wit_hash = read_tx_and_size(raw_tx, 0)
-                # Convert the inputs and outputs into (hashX, value) pairs
-                # Drop generation-like inputs from MemPoolTx.prevouts
-                txin_pairs = tuple((txin.prev_hash, txin.prev_idx)
-                                   for txin in tx.inputs
-                                   if not txin.is_generation())
-                txout_tuple_list = []
-                for vout_n, txout in enumerate(tx.outputs):
-                    value = txout.value
-
-                    # Every vout needs to be added for other methods to work properly
-
-                    # Best effort for standard scripts
-                    ops = Script.get_ops(txout.pk_script)
-                    op_ptr = -1
-                    for i in range(len(ops)):
-                        op = ops[i][0]  # The OpCode
-                        if op == OpCodes.OP_RVN_ASSET:
-                            op_ptr = i
-                            break
-
-                    if op_ptr > 0:
-                        # This script has OP_RVN_ASSET. Use everything before this for the script hash.
-                        # Get the raw script bytes ending ptr from the previous opcode.
-                        script_hash_end = ops[op_ptr - 1][1]
-                        hashX = to_hashX(txout.pk_script[:script_hash_end])
-                    else:
-                        # There is no OP_RVN_ASSET. Hash as-is.
-                        hashX = to_hashX(txout.pk_script)
-
-                    # Best effort for standard asset portions
-                    if 0 < op_ptr < len(ops):
-                        try:
-                            next_op = ops[op_ptr + 1]
-                            asset_script = next_op[2]
-                            asset_deserializer = DataParser(asset_script)
-                            asset_deserializer.read_bytes(3)
-                            asset_type = asset_deserializer.read_int()
-                            asset_name = asset_deserializer.read_var_bytes()
-                            if asset_type == b'o'[0]:
-                                txout_tuple_list.append((hashX, 100_000_000, True, asset_name.decode('ascii')))
-                                asset_meta_creates[asset_name.decode('ascii')] = {
-                                    'sats_in_circulation': 100_000_000,
-                                    'divisions': 0,
-                                    'reissuable': False,
-                                    'has_ipfs': False,
-                                    'source': {
-                                        'tx_hash': hash_to_hex_str(tx_hash),
-                                        'tx_pos': vout_n,
-                                        'height': -1
-                                    }
-                                }
-                            else:
-                                value = int.from_bytes(asset_deserializer.read_bytes(8), 'little', signed=False)
-                                txout_tuple_list.append((hashX, value, True, asset_name.decode('ascii')))
-                                # Asset reissue chaining is not allowed. There may only be
-                                # one reissue in the mempool per asset name
-                                if asset_type == b'r'[0]:
-                                    divisions = asset_deserializer.read_int()
-                                    reissuable = asset_deserializer.read_int()
-                                    if asset_deserializer.cursor + 34 <= asset_deserializer.length:
-                                        asset_data = asset_deserializer.read_bytes(34)
-                                    else:
-                                        asset_data = None
-                                    d = {
-                                        'sats_in_circulation': value,
-                                        'divisions': divisions,
-                                        'reissuable': True if reissuable != 0 else False,
-                                        'has_ipfs': True if asset_data else False,
-                                    }
-                                    if asset_data:
-                                      d['ipfs'] = base_encode(asset_data, 58) if asset_data else None
-                                    
-                                    d['source'] = {
-                                            'tx_hash': hash_to_hex_str(tx_hash),
-                                            'tx_pos': vout_n,
-                                            'height': -1
-                                        }
-                                    asset_meta_reissues[asset_name.decode('ascii')] = d
-                                elif asset_type == b'q'[0]:
-                                    divisions = asset_deserializer.read_int()
-                                    reissuable = asset_deserializer.read_int()
-                                    has_meta = asset_deserializer.read_byte()
-                                    if has_meta != b'\0':
-                                        asset_data = asset_deserializer.read_bytes(34)
-                                    else:
-                                        asset_data = None
-
-                                    d = {
-                                        'sats_in_circulation': value,
-                                        'divisions': divisions,
-                                        'has_ipfs': True if asset_data else False,
-                                        'reissuable': True if reissuable != 0 else False,
-                                    }
-                                    if asset_data:
-                                        d['ipfs'] = base_encode(asset_data, 58) if asset_data else None
-                                    d['source'] = {
-                                            'tx_hash': hash_to_hex_str(tx_hash),
-                                            'tx_pos': vout_n,
-                                            'height': -1
-                                        }
-
-                                    asset_meta_creates[asset_name.decode('ascii')] = d
-                        except Exception:
-                            txout_tuple_list.append((hashX, value, False, None))
-                    else:
-                        txout_tuple_list.append((hashX, value, False, None))
-
-                txout_pairs = tuple(txout_tuple_list)
-                txs[tx_hash] = MemPoolTx(txin_pairs, None, txout_pairs,
-                                         0, tx_size)
-            return txs, asset_meta_creates, asset_meta_reissues
-
-        # Thread this potentially slow operation so as not to block
-        tx_map, internal_creates, internal_reissues = await run_in_thread(deserialize_txs)
-
-        for asset, stats in internal_creates.items():
-            hash_b = hex_str_to_hash(stats['source']['tx_hash'])
+        # Parse in a separate process as this is CPU bound and slow
+        parse_pool = self._parse_pool
+        parsed = None
+        if parse_pool:
+            loop = asyncio.get_running_loop()
+            try:
+                parsed = await loop.run_in_executor(
+                    parse_pool, _parse_tx_chunk, self.coin, hashes, hex_hashes, raw_txs)
+            except BrokenProcessPool:
+                # A worker died, e.g. it was killed by the OOM killer.  Replace
+                # the pool for later refreshes and parse this chunk in a thread
+                if self._parse_pool is parse_pool:
+                    self.logger.warning('mempool parsing process pool broke; restarting it')
+                    parse_pool.shutdown(wait=False)
+                    self._parse_pool = self._new_parse_pool()
+        if parsed is None:
+            parsed = await run_in_thread(_parse_tx_chunk, self.coin, hashes, hex_hashes, raw_txs)
+        tx_map, internal_creates, internal_reissues = parsed
+
+        for asset, (hash_b, stats) in internal_creates.items():
             if hash_b not in tx_to_create:
                 tx_to_create[hash_b] = set()
             tx_to_create[hash_b].add(asset)
             creates[asset] = stats
 
-        for asset, stats in internal_reissues.items():
-            hash_b = hex_str_to_hash(stats['source']['tx_hash'])
+        for asset, (hash_b, stats) in internal_reissues.items():
             if hash_b not in tx_to_reissue:
                 tx_to_reissue[hash_b] = set()
             tx_to_reissue[hash_b].add(asset)
             reissues[asset] = stats
 
+        return tx_map
+
+    async def _resolve_and_accept(self, tx_map, all_hashes, touched, assets_touched, rechecks):
+        '''Look up the prevouts of all new mempool transactions and accept
+        them.
+
+        Returns the map of transactions that could not be accepted.'''
         # Determine all prevouts not in the mempool, and fetch the
         # UTXO information from the database.  Failed prevout lookups
         # return None - concurrent database updates happen - which is
         # relied upon by _accept_transactions. Ignore prevouts that are
-        # generation-like.
-        prevouts = tuple(prevout for tx in tx_map.values()
-                         for prevout in tx.prevouts
-                         if prevout[0] not in all_hashes)
-
-        utxos = []
-
-        for hX, v in await self.api.lookup_utxos(prevouts):
-            utxos.append((hX, v, False, None))
-
-        for hX, v, name in await self.api.lookup_assets(prevouts):
-            utxos.append((hX, v, True, name))
-
-        utxo_map = {prevout: utxo for prevout, utxo in zip(prevouts, utxos)}
-
-        return self._accept_transactions(tx_map, utxo_map, touched, assets_touched)
+        # generation-like.  A set as several txs may spend the same prevout.
+        prevouts = tuple({prevout for tx in tx_map.values()
+                          for prevout in tx.prevouts
+                          if prevout[0] not in all_hashes})
+
+        # Both lookups return one entry per prevout.  Asset outputs are
+        # in the UTXO DB too, so an asset entry takes precedence
+        utxos = await self.api.lookup_utxos(prevouts)
+        assets = await self.api.lookup_assets(prevouts)
+
+        utxo_map = {}
+        for prevout, utxo, asset in zip(prevouts, utxos, assets):
+            if asset:
+                hashX, value, name = asset
+                utxo_map[prevout] = (hashX, value, True, name)
+            elif utxo:
+                hashX, value = utxo
+                utxo_map[prevout] = (hashX, value, False, None)
+
+        # Threaded as a large refresh would otherwise stall the event loop.
+        # Readers only see the published maps so they are unaffected
+        return await run_in_thread(self._accept_transactions, tx_map, utxo_map,
+                                   touched, assets_touched, rechecks)
 
     #
     # External interface
@@ -560,33 +732,26 @@ class MemPool(object):
     async def keep_synchronized(self, synchronized_event):
         '''Keep the mempool synchronized with the daemon.'''
 
-        async with TaskGroup() as group:
-            await group.spawn(self._refresh_hashes(synchronized_event))
-            await group.spawn(self._refresh_histogram(synchronized_event))
-            await group.spawn(self._logging(synchronized_event))
+        try:
+            async with TaskGroup() as group:
+                await group.spawn(self._refresh_hashes(synchronized_event))
+                await group.spawn(self._refresh_histogram(synchronized_event))
+                await group.spawn(self._logging(synchronized_event))
 
-            async for task in group:
-                if not task.cancelled():
-                    task.result()
+                async for task in group:
+                    if not task.cancelled():
+                        task.result()
+        finally:
+            if self._parse_pool:
+                self._parse_pool.shutdown(wait=False)
 
     async def asset_balance_delta(self, hashX):
         ret = {}
-        if hashX in self.hashXs:
-            for hash_ in self.hashXs[hashX]:
-                tx = self.txs[hash_]
-                for hX, v, is_asset, name in tx.in_pairs:
-                    if hX == hashX and is_asset:
-                        if name not in ret:
-                            ret[name] = -v
-                        else:
-                            ret[name] -= v
-                for hX, v, is_asset, name in tx.out_pairs:
-                    if hX == hashX and is_asset:
-                        if name not in ret:
-                            ret[name] = v
-                        else:
-                            ret[name] += v
-
+        hashX_deltas = self.hashX_deltas
+        for _sat_delta, _utxos, assets in hashX_deltas.get(hashX, {}).values():
+            if assets:
+                for name, v in assets[0].items():
+                    ret[name] = ret.get(name, 0) + v
         return ret
 
     async def balance_delta(self, hashX):
@@ -595,11 +760,9 @@ class MemPool(object):
         Can be positive or negative.
         '''
         value = 0
-        if hashX in self.hashXs:
-            for hash_ in self.hashXs[hashX]:
-                tx = self.txs[hash_]
-                value -= sum(v for h168, v, is_asset, _ in tx.in_pairs if h168 == hashX and not is_asset)
-                value += sum(v for h168, v, is_asset, _ in tx.out_pairs if h168 == hashX and not is_asset)
+        hashX_deltas = self.hashX_deltas
+        for sat_delta, _utxos, _assets in hashX_deltas.get(hashX, {}).values():
+            value += sat_delta
         return value
 
     async def compact_fee_histogram(self):
@@ -614,18 +777,19 @@ class MemPool(object):
         actual spends of it (in the DB or mempool) will be included.
         '''
         result = set()
-        for tx_hash in self.hashXs.get(hashX, ()):
-            tx = self.txs[tx_hash]
+        txs, hashXs = self.txs, self.hashXs
+        for tx_hash in hashXs.get(hashX, ()):
+            tx = txs[tx_hash]
             result.update(tx.prevouts)
         return result
 
     async def transaction_summaries(self, hashX):
         '''Return a list of MemPoolTxSummary objects for the hashX.'''
         result = []
-        for tx_hash in self.hashXs.get(hashX, ()):
-            tx = self.txs[tx_hash]
-            has_ui = any(hash in self.txs for hash, idx in tx.prevouts)
-            result.append(MemPoolTxSummary(tx_hash, tx.fee, has_ui))
+        txs, hashXs = self.txs, self.hashXs
+        for tx_hash in hashXs.get(hashX, ()):
+            tx = txs[tx_hash]
+            result.append(MemPoolTxSummary(tx_hash, tx.fee, tx.has_unconfirmed_inputs))
         return result
 
     async def unordered_UTXOs(self, hashX):
@@ -636,19 +800,18 @@ class MemPool(object):
         the outputs.
         '''
         utxos = []
-        for tx_hash in self.hashXs.get(hashX, ()):
-            tx = self.txs.get(tx_hash)
-            for pos, (hX, value, is_asset, _) in enumerate(tx.out_pairs):
-                if hX == hashX and not is_asset:
-                    utxos.append(UTXO(-1, pos, tx_hash, 0, value))
+        hashX_deltas = self.hashX_deltas
+        for tx_hash, (_sat_delta, tx_utxos, _assets) in hashX_deltas.get(hashX, {}).items():
+            for pos, value in tx_utxos:
+                utxos.append(UTXO(-1, pos, tx_hash, 0, value))
         return utxos
 
     async def unordered_ASSETs(self, hashX):
         assets = []
-        for tx_hash in self.hashXs.get(hashX, ()):
-            tx = self.txs.get(tx_hash)
-            for pos, (hX, value, is_asset, name) in enumerate(tx.out_pairs):
-                if hX == hashX and is_asset:
+        hashX_deltas = self.hashX_deltas
+        for tx_hash, (_sat_delta, _utxos, tx_assets) in hashX_deltas.get(hashX, {}).items():
+            if tx_assets:
+                for pos, name, value in tx_assets[1]:
                     assets.append(ASSET(-1, pos, tx_hash, 0, name, value))
         return assets
 
@@ -1,6 +1,6 @@
 import pytest
 
-from electrumx.lib.script import OpCodes, is_unspendable_legacy, is_unspendable_genesis
+from electrumx.lib.script import OpCodes, Script, is_unspendable_legacy, is_unspendable_genesis
 
 
 @pytest.mark.parametrize("script, iug", (
@@ -24,3 +24,35 @@ def test_op_return_legacy(script, iug):
 def test_not_op_return(script):
     assert not is_unspendable_legacy(script)
     assert not is_unspendable_genesis(script)
+
+
+P2PKH = bytes([OpCodes.OP_DUP, OpCodes.OP_HASH160, 20]) + bytes(20) + \
+    bytes([OpCodes.OP_EQUALVERIFY, OpCodes.OP_CHECKSIG])
+
+
+@pytest.mark.parametrize("script", (
+    bytes([]),
+    P2PKH,
+    P2PKH + bytes([OpCodes.OP_RVN_ASSET]),
+    P2PKH + bytes([OpCodes.OP_RVN_ASSET, OpCodes.OP_DROP]),
+    P2PKH + bytes([OpCodes.OP_RVN_ASSET, 3]) + b'evr' + bytes([OpCodes.OP_DROP]),
+    P2PKH + bytes([OpCodes.OP_RVN_ASSET, OpCodes.OP_PUSHDATA1, 3]) + b'evr',
+    P2PKH + bytes([OpCodes.OP_RVN_ASSET, 10]) + b'evr',
+    bytes([OpCodes.OP_RVN_ASSET, 3]) + b'evr',
+    bytes([OpCodes.OP_PUSHDATA2, 1, OpCodes.OP_RVN_ASSET, 3]) + b'evr',
+))
+def test_find_asset_op(script):
+    # Compare against the equivalent scan over get_ops
+    ops = Script.get_ops(script)
+    op_ptr = next((i for i, op in enumerate(ops) if op[0] == OpCodes.OP_RVN_ASSET), -1)
+    expected_end = ops[op_ptr - 1][1] if op_ptr > 0 else len(script)
+    expected_data = None
+    if op_ptr > 0 and op_ptr + 1 < len(ops) and len(ops[op_ptr + 1]) > 2:
+        expected_data = ops[op_ptr + 1][2]
+
+    script_end, asset_start, asset_end = Script.find_asset_op(script)
+    assert script_end == expected_end
+    if expected_data is None:
+        assert asset_start is None and asset_end is None
+    else:
+        assert script[asset_start:asset_end] == expected_data
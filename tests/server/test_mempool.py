@@ -1,19 +1,25 @@
 import datetime
 import logging
+import math
 import os
 from collections import defaultdict
+from fractions import Fraction
 from functools import partial
 from random import randrange, choice, seed
+from types import SimpleNamespace
 
 import pytest
 from aiorpcx import Event, TaskGroup, sleep, ignore_after
 
-from electrumx.lib.coins import Bitcoin
+from electrumx.lib.coins import Evrmore
 from electrumx.lib.hash import HASHX_LEN, hex_str_to_hash, hash_to_hex_str, double_sha256
+from electrumx.lib.script import OpCodes, Script
 from electrumx.lib.tx import Tx, TxInput, TxOutput
-from electrumx.server.mempool import MemPool, MemPoolAPI
+from electrumx.server.db import ASSET
+from electrumx.server.mempool import MemPool, MemPoolAPI, MemPoolTx, _parse_tx_chunk
 
-coin = Bitcoin
+coin = Evrmore
+env = SimpleNamespace(coin=coin, mempool_parse_workers=2)
 # Change seed daily
 seed(datetime.date.today().toordinal())
 
@@ -47,7 +53,7 @@ def random_tx(hash160s, utxos):
         pk_script = coin.hash160_to_P2PKH_script(choice(hash160s))
         outputs.append(TxOutput(value, pk_script))
 
-    tx = Tx(2, inputs, outputs, 0)
+    tx = Tx(2, inputs, outputs, 0, None)
     tx_bytes = tx.serialize()
     tx_hash = double_sha256(tx_bytes)
     for n, output in enumerate(tx.outputs):
@@ -56,6 +62,23 @@ def random_tx(hash160s, utxos):
     return tx, tx_hash, tx_bytes
 
 
+def add_tx_chain(api, length):
+    '''Add a chain of txs to the mempool, each spending the one before and
+    the first spending a new DB UTXO.  Return their hashes.'''
+    hash160s = [os.urandom(20) for n in range(5)]
+    api.hashXs.extend(coin.hash160_to_P2PKH_hashX(hash160) for hash160 in hash160s)
+    prevout = (os.urandom(32), 0)
+    api.db_utxos[prevout] = (choice(api.hashXs), coin.VALUE_PER_COIN)
+    unspent_utxos = {prevout: api.db_utxos[prevout]}
+    tx_hashes = []
+    for n in range(length):
+        tx, tx_hash, raw_tx = random_tx(hash160s, unspent_utxos)
+        api.raw_txs[tx_hash] = raw_tx
+        api.txs[tx_hash] = tx
+        tx_hashes.append(tx_hash)
+    return tx_hashes
+
+
 class API(MemPoolAPI):
 
     def __init__(self):
@@ -230,6 +253,12 @@ class API(MemPoolAPI):
         await sleep(0)
         return [self.db_utxos.get(prevout) for prevout in prevouts]
 
+    async def lookup_assets(self, prevouts):
+        '''Return a list of (hashX, value, name) tuples for each prevout if
+        it is an unspent asset, otherwise None.'''
+        await sleep(0)
+        return [None for prevout in prevouts]
+
     async def on_mempool(self, touched, height, assets):
         '''Called each time the mempool is synchronized.  touched is a set of
         hashXs touched since the previous call.  height is the
@@ -254,6 +283,57 @@ class DropAPI(API):
         return await super().raw_transactions(hex_hashes)
 
 
+class GatedAPI(API):
+    '''Raw tx requests wait for gate, if set, once entered is set.'''
+
+    def __init__(self):
+        super().__init__()
+        self.gate = None
+        self.entered = Event()
+
+    async def raw_transactions(self, hex_hashes):
+        if self.gate:
+            self.entered.set()
+            await self.gate.wait()
+        return await super().raw_transactions(hex_hashes)
+
+
+class AssetAPI(API):
+    '''As in the DB, asset UTXOs are also in db_utxos with no sats.'''
+
+    def __init__(self):
+        super().__init__()
+        self.db_assets = {}
+
+    def add_asset_spends(self, count):
+        '''Add txs each spending a DB asset UTXO and a DB UTXO.'''
+        hash160s = [os.urandom(20) for n in range(count)]
+        for n, hash160 in enumerate(hash160s):
+            hashX = coin.hash160_to_P2PKH_hashX(hash160)
+            self.hashXs.append(hashX)
+            asset_prevout = (os.urandom(32), randrange(0, 10))
+            self.db_utxos[asset_prevout] = (hashX, 0)
+            self.db_assets[asset_prevout] = (hashX, randrange(1, 1000), f'ASSET{n}')
+            prevout = (os.urandom(32), randrange(0, 10))
+            value = randrange(1000, coin.VALUE_PER_COIN)
+            self.db_utxos[prevout] = (choice(self.hashXs), value)
+            inputs = [TxInput(prev_hash, prev_idx, b'', 4294967295)
+                      for prev_hash, prev_idx in (asset_prevout, prevout)]
+            if randrange(0, 2):
+                inputs.reverse()
+            pk_script = coin.hash160_to_P2PKH_script(choice(hash160s))
+            tx = Tx(2, inputs, [TxOutput(value - randrange(500), pk_script)], 0, None)
+            raw_tx = tx.serialize()
+            tx_hash = double_sha256(raw_tx)
+            self.raw_txs[tx_hash] = raw_tx
+            self.txs[tx_hash] = tx
+            self.ordered_adds.append(tx_hash)
+
+    async def lookup_assets(self, prevouts):
+        await sleep(0)
+        return [self.db_assets.get(prevout) for prevout in prevouts]
+
+
 def in_caplog(caplog, message):
     return any(message in record.message for record in caplog.records)
 
@@ -261,7 +341,7 @@ def in_caplog(caplog, message):
 @pytest.mark.asyncio
 async def test_keep_synchronized(caplog):
     api = API()
-    mempool = MemPool(coin, api)
+    mempool = MemPool(env, api)
     event = Event()
     with caplog.at_level(logging.INFO):
         async with TaskGroup() as group:
@@ -280,7 +360,7 @@ async def test_keep_synchronized(caplog):
 async def test_balance_delta():
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api)
+    mempool = MemPool(env, api)
     event = Event()
     async with TaskGroup() as group:
         await group.spawn(mempool.keep_synchronized, event)
@@ -303,7 +383,7 @@ async def test_balance_delta():
 async def test_potential_spends():
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api)
+    mempool = MemPool(env, api)
     event = Event()
     async with TaskGroup() as group:
         await group.spawn(mempool.keep_synchronized, event)
@@ -334,10 +414,11 @@ async def _test_summaries(mempool, api):
 
 
 @pytest.mark.asyncio
-async def test_transaction_summaries(caplog):
+@pytest.mark.parametrize("parse_workers", (0, 2))
+async def test_transaction_summaries(caplog, parse_workers):
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api)
+    mempool = MemPool(SimpleNamespace(coin=coin, mempool_parse_workers=parse_workers), api)
     event = Event()
     with caplog.at_level(logging.INFO):
         async with TaskGroup() as group:
@@ -354,11 +435,58 @@ async def test_transaction_summaries(caplog):
     assert not in_caplog(caplog, 'txs dropped')
 
 
+def reference_compact_histogram(txs, bin_size):
+    '''The compact fee histogram computed directly from fees and sizes.'''
+    histogram = defaultdict(int)
+    for tx in txs:
+        histogram[math.floor(Fraction(10 * tx.fee, tx.size)) / 10] += tx.size
+    compact = []
+    cum_size = 0
+    prev_fee_rate = None
+    for fee_rate, size in sorted(histogram.items(), reverse=True):
+        if size > 2 * bin_size and prev_fee_rate is not None and cum_size > 0:
+            compact.append((prev_fee_rate, cum_size))
+            cum_size = 0
+            bin_size *= 1.1
+        cum_size += size
+        if cum_size > bin_size:
+            compact.append((fee_rate, cum_size))
+            cum_size = 0
+            bin_size *= 1.1
+        prev_fee_rate = fee_rate
+    return compact
+
+
+def test_update_histogram():
+    hashX = os.urandom(HASHX_LEN)
+    tx_map = {}
+    utxo_map = {}
+    for n in range(5000):
+        size = randrange(100, 20_000)
+        # Many txs pay round fee rates so some buckets are big lumps
+        if randrange(0, 4):
+            fee = randrange(0, size * 50)
+        else:
+            fee = size * choice((1, 5, 20))
+        prevout = (os.urandom(32), 0)
+        utxo_map[prevout] = (hashX, fee + 1000, False, None)
+        tx_map[os.urandom(32)] = MemPoolTx((prevout, ), ((hashX, 1000, False, None), ), size)
+
+    mempool = MemPool(env, API())
+    touched = set()
+    assert not mempool._accept_transactions(tx_map, utxo_map, touched, set(), set())
+    mempool._publish(touched, set())
+    for bin_size in (10_000, 100_000):
+        mempool._update_histogram(bin_size)
+        expected = reference_compact_histogram(mempool.txs.values(), bin_size)
+        assert mempool.cached_compact_histogram == expected
+
+
 @pytest.mark.asyncio
 async def test_unordered_UTXOs():
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api)
+    mempool = MemPool(env, api)
     event = Event()
     async with TaskGroup() as group:
         await group.spawn(mempool.keep_synchronized, event)
@@ -378,11 +506,172 @@ async def test_unordered_UTXOs():
         assert set(our_result) == set(mempool_result)
 
 
+@pytest.mark.asyncio
+async def test_asset_prevouts():
+    # Asset prevouts must be paired with their own lookup results
+    api = AssetAPI()
+    api.initialize()
+    api.add_asset_spends(20)
+    mempool = MemPool(env, api)
+    event = Event()
+    async with TaskGroup() as group:
+        await group.spawn(mempool.keep_synchronized, event)
+        await event.wait()
+        await group.cancel_remaining()
+
+    await _test_summaries(mempool, api)
+    deltas = api.balance_deltas()
+    for hashX in api.hashXs:
+        assert await mempool.balance_delta(hashX) == deltas.get(hashX, 0)
+    for hashX, value, name in api.db_assets.values():
+        assert await mempool.asset_balance_delta(hashX) == {name: -value}
+
+
+def asset_transfer_script(hash160, name, value):
+    asset = b'evrt' + bytes([len(name)]) + name.encode('ascii') + value.to_bytes(8, 'little')
+    return (coin.hash160_to_P2PKH_script(hash160) + bytes([OpCodes.OP_RVN_ASSET]) +
+            Script.push_data(asset) + bytes([OpCodes.OP_DROP]))
+
+
+@pytest.mark.asyncio
+async def test_asset_outputs():
+    api = AssetAPI()
+    senders, receivers = [], []
+    for n in range(10):
+        sender, receiver = os.urandom(20), os.urandom(20)
+        sender_hashX = coin.hash160_to_P2PKH_hashX(sender)
+        receiver_hashX = coin.hash160_to_P2PKH_hashX(receiver)
+        name = f'ASSET{n}'
+        value = randrange(2, 1000)
+        asset_prevout = (os.urandom(32), 0)
+        api.db_utxos[asset_prevout] = (sender_hashX, 0)
+        api.db_assets[asset_prevout] = (sender_hashX, value, name)
+        prevout = (os.urandom(32), 0)
+        api.db_utxos[prevout] = (sender_hashX, coin.VALUE_PER_COIN)
+
+        # Send some or all of the asset, returning any change to the sender
+        sent = randrange(1, value + 1)
+        outputs = [TxOutput(0, asset_transfer_script(receiver, name, sent))]
+        if sent < value:
+            outputs.append(TxOutput(0, asset_transfer_script(sender, name, value - sent)))
+        outputs.append(TxOutput(coin.VALUE_PER_COIN - 500,
+                                coin.hash160_to_P2PKH_script(sender)))
+        inputs = [TxInput(prev_hash, prev_idx, b'', 4294967295)
+                  for prev_hash, prev_idx in (asset_prevout, prevout)]
+        tx = Tx(2, inputs, outputs, 0, None)
+        raw_tx = tx.serialize()
+        tx_hash = double_sha256(raw_tx)
+        api.raw_txs[tx_hash] = raw_tx
+        api.txs[tx_hash] = tx
+        senders.append((sender_hashX, tx_hash, name, value, sent))
+        receivers.append((receiver_hashX, tx_hash, name, sent))
+
+    mempool = MemPool(env, api)
+    event = Event()
+    async with TaskGroup() as group:
+        await group.spawn(mempool.keep_synchronized, event)
+        await event.wait()
+        await group.cancel_remaining()
+
+    for hashX, tx_hash, name, sent in receivers:
+        assert await mempool.unordered_ASSETs(hashX) == [ASSET(-1, 0, tx_hash, 0, name, sent)]
+        assert await mempool.unordered_UTXOs(hashX) == []
+        assert await mempool.asset_balance_delta(hashX) == {name: sent}
+        assert await mempool.balance_delta(hashX) == 0
+    for hashX, tx_hash, name, value, sent in senders:
+        expected = []
+        if sent < value:
+            expected.append(ASSET(-1, 1, tx_hash, 0, name, value - sent))
+        assert await mempool.unordered_ASSETs(hashX) == expected
+        assert await mempool.asset_balance_delta(hashX) == {name: -sent}
+        assert await mempool.balance_delta(hashX) == -500
+
+
+@pytest.mark.asyncio
+async def test_accept_child_before_parent():
+    # A chain of txs where each spends the one before, listed child first
+    api = API()
+    hash160s = [os.urandom(20) for n in range(10)]
+    api.hashXs = [coin.hash160_to_P2PKH_hashX(hash160) for hash160 in hash160s]
+    prevout = (os.urandom(32), 0)
+    api.db_utxos = {prevout: (choice(api.hashXs), coin.VALUE_PER_COIN)}
+    unspent_utxos = api.db_utxos.copy()
+    for n in range(5):
+        tx, tx_hash, raw_tx = random_tx(hash160s, unspent_utxos)
+        api.raw_txs[tx_hash] = raw_tx
+        api.txs[tx_hash] = tx
+        api.ordered_adds.append(tx_hash)
+
+    hashes = api.ordered_adds[::-1]
+    tx_map, _creates, _reissues = _parse_tx_chunk(
+        coin, hashes, [hash_to_hex_str(hash) for hash in hashes],
+        [api.raw_txs[hash] for hash in hashes])
+    assert list(tx_map) == hashes
+    utxo_map = {prevout: api.db_utxos[prevout] + (False, None)}
+
+    mempool = MemPool(env, api)
+    touched = set()
+    assert not mempool._accept_transactions(tx_map, utxo_map, touched, set(), set())
+    assert set(mempool._txs) == set(hashes)
+    assert touched == api.touched(hashes)
+    for tx_hash in hashes:
+        tx = mempool._txs[tx_hash]
+        assert tx.has_unconfirmed_inputs == (tx_hash != api.ordered_adds[0])
+
+
+@pytest.mark.asyncio
+async def test_hashX_tx_list_growth():
+    # A hashX's tx list is a tuple until it holds more than
+    # HASHX_TUPLE_MAX txs, then a set
+    api = API()
+    hash160 = os.urandom(20)
+    hashX = coin.hash160_to_P2PKH_hashX(hash160)
+    api.hashXs = [hashX]
+    raw_txs = {}
+    for n in range(MemPool.HASHX_TUPLE_MAX + 2):
+        prevout = (os.urandom(32), 0)
+        api.db_utxos[prevout] = (coin.hash160_to_P2PKH_hashX(os.urandom(20)), 1000)
+        tx = Tx(2, [TxInput(prevout[0], prevout[1], b'', 4294967295)],
+                [TxOutput(900, coin.hash160_to_P2PKH_script(hash160))], 0, None)
+        raw_tx = tx.serialize()
+        tx_hash = double_sha256(raw_tx)
+        raw_txs[tx_hash] = raw_tx
+        api.txs[tx_hash] = tx
+    all_txs = api.txs
+    ordered = list(all_txs)
+
+    def set_mempool(count):
+        api.txs = {tx_hash: all_txs[tx_hash] for tx_hash in ordered[:count]}
+        api.raw_txs = {tx_hash: raw_txs[tx_hash] for tx_hash in api.txs}
+
+    mempool = MemPool(env, api, refresh_secs=0.01)
+    event = Event()
+    set_mempool(2)
+    async with TaskGroup() as group:
+        await group.spawn(mempool.keep_synchronized, event)
+        await event.wait()
+        # Grow past the limit then shrink again
+        for count, kind in ((2, tuple), (len(ordered), frozenset), (3, frozenset)):
+            set_mempool(count)
+            # The refresh in progress may predate the change
+            await event.wait()
+            await event.wait()
+            assert type(mempool.hashXs[hashX]) is kind
+            assert sorted(mempool.hashXs[hashX]) == sorted(api.txs)
+            await _test_summaries(mempool, api)
+        set_mempool(0)
+        await event.wait()
+        await event.wait()
+        assert hashX not in mempool.hashXs
+        assert hashX not in mempool._hashX_pool
+        await group.cancel_remaining()
+
+
 @pytest.mark.asyncio
 async def test_mempool_removals():
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api, refresh_secs=0.01)
+    mempool = MemPool(env, api, refresh_secs=0.01)
     event = Event()
     async with TaskGroup() as group:
         await group.spawn(mempool.keep_synchronized, event)
@@ -406,13 +695,80 @@ async def test_mempool_removals():
         await group.cancel_remaining()
 
 
+@pytest.mark.asyncio
+async def test_parent_removed_and_readded():
+    # A parent leaves the mempool, e.g. in a block, and returns on a reorg
+    # while its child stays in the mempool
+    api = API()
+    api.initialize(mempool_size=60)
+    parent_hash, child_hash = add_tx_chain(api, 2)
+    parent_hashes = api.ordered_adds[:15] + [parent_hash]
+    txs = api.txs.copy()
+    # The parents' outputs are in the DB while they are confirmed
+    api.db_utxos.update(api.mempool_utxos())
+
+    mempool = MemPool(env, api, refresh_secs=0.01)
+    event = Event()
+    async with TaskGroup() as group:
+        await group.spawn(mempool.keep_synchronized, event)
+        await event.wait()
+        assert mempool.txs[child_hash].has_unconfirmed_inputs
+        # The parents confirm
+        api.txs = {tx_hash: tx for tx_hash, tx in txs.items()
+                   if tx_hash not in parent_hashes}
+        await event.wait()
+        await event.wait()
+        await _test_summaries(mempool, api)
+        assert not mempool.txs[child_hash].has_unconfirmed_inputs
+        # The parents return to the mempool
+        api.txs = txs
+        await event.wait()
+        await event.wait()
+        await _test_summaries(mempool, api)
+        assert mempool.txs[child_hash].has_unconfirmed_inputs
+        await group.cancel_remaining()
+
+
+@pytest.mark.asyncio
+async def test_refresh_published_whole():
+    # Readers see the previous refresh until the next one is complete
+    api = GatedAPI()
+    api.initialize()
+    parent_hash, child_hash = add_tx_chain(api, 2)
+    api.db_utxos.update(api.mempool_utxos())
+    mempool = MemPool(env, api, refresh_secs=0.01)
+    event = Event()
+    async with TaskGroup() as group:
+        await group.spawn(mempool.keep_synchronized, event)
+        await event.wait()
+        txs, hashXs, hashX_deltas = mempool.txs, mempool.hashXs, mempool.hashX_deltas
+        summaries = [await mempool.transaction_summaries(hashX) for hashX in api.hashXs]
+        assert mempool.txs[child_hash].has_unconfirmed_inputs
+        # The parent confirms and a new tx arrives; hold the refresh
+        # once it has handled the parent and is fetching the new tx
+        api.gate = Event()
+        del api.txs[parent_hash]
+        add_tx_chain(api, 1)
+        await api.entered.wait()
+        assert mempool.txs is txs
+        assert mempool.hashXs is hashXs
+        assert mempool.hashX_deltas is hashX_deltas
+        assert [await mempool.transaction_summaries(hashX)
+                for hashX in api.hashXs[:len(summaries)]] == summaries
+        api.gate.set()
+        await event.wait()
+        await _test_summaries(mempool, api)
+        assert not mempool.txs[child_hash].has_unconfirmed_inputs
+        await group.cancel_remaining()
+
+
 @pytest.mark.asyncio
 async def test_daemon_drops_txs():
     # Tests things work if the daemon drops some transactions between
     # returning their hashes and the mempool requesting the raw txs
     api = DropAPI(10)
     api.initialize()
-    mempool = MemPool(coin, api, refresh_secs=0.01)
+    mempool = MemPool(env, api, refresh_secs=0.01)
     event = Event()
     async with TaskGroup() as group:
         await group.spawn(mempool.keep_synchronized, event)
@@ -429,7 +785,7 @@ async def test_notifications(caplog):
     # 3) A block comes in confirming the first batch only
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api, refresh_secs=0.001, log_status_secs=0)
+    mempool = MemPool(env, api, refresh_secs=0.001, log_status_secs=0)
     event = Event()
 
     n = len(api.ordered_adds) // 2
@@ -451,7 +807,7 @@ async def test_notifications(caplog):
         await group.spawn(mempool.keep_synchronized, event)
         await event.wait()
         assert len(api.on_mempool_calls) == 1
-        touched, height = api.on_mempool_calls[0]
+        touched, height, _assets = api.on_mempool_calls[0]
         assert height == api._height == api._db_height == api._cached_height
         assert touched == first_touched
         # Second batch enters the mempool
@@ -459,7 +815,7 @@ async def test_notifications(caplog):
         api.txs = txs
         await event.wait()
         assert len(api.on_mempool_calls) == 2
-        touched, height = api.on_mempool_calls[1]
+        touched, height, _assets = api.on_mempool_calls[1]
         assert height == api._height == api._db_height == api._cached_height
         # Touched is incremental
         assert touched == second_touched
@@ -484,7 +840,7 @@ async def test_notifications(caplog):
             del api.db_utxos[spend]
         await event.wait()
         assert len(api.on_mempool_calls) == 3
-        touched, height = api.on_mempool_calls[2]
+        touched, height, _assets = api.on_mempool_calls[2]
         assert height == api._db_height == new_height
         assert touched == first_touched
         await group.cancel_remaining()
@@ -494,7 +850,7 @@ async def test_notifications(caplog):
 async def test_dropped_txs(caplog):
     api = API()
     api.initialize()
-    mempool = MemPool(coin, api)
+    mempool = MemPool(env, api)
     event = Event()
     # Remove a single TX_HASH that is used in another mempool tx
     for prev_hash, prev_idx in api.mempool_spends():